@@ -1,26 +1,29 @@
-from __future__ import absolute_import
-from __future__ import print_function
-from __future__ import unicode_literals
-
 __all__ = ["S3FS"]
 
-import contextlib
-from datetime import datetime, timedelta
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import io
 import itertools
 import os
+import shutil
 import tempfile
 import threading
 import mimetypes
+from time import monotonic
+
+from typing import Optional
+from urllib.parse import urlunsplit
 
+import certifi
 import minio
 from minio import S3Error
+import urllib3
 from minio.datatypes import (
     Object as minioObject
 )
-
-import six
-from six import text_type
+from minio.deleteobjects import DeleteObject
 
 from fs import ResourceType
 from fs.base import FS
@@ -28,7 +31,27 @@ from fs.info import Info
 from fs import errors
 from fs.mode import Mode
 from fs.path import basename, dirname, forcedir, join, normpath, relpath
-from fs.time import datetime_to_epoch
+
+
+@functools.lru_cache(maxsize=1024)
+def _guess_content_type(ext):
+    """Guess the content type for a (lower case) file extension."""
+    mime_type, _encoding = mimetypes.guess_type("x" + ext)
+    return mime_type or "binary/octet-stream"
+
+
+@functools.lru_cache(maxsize=4096)
+def _convert_path_to_key(prefix, delimiter, path, is_dir=False):
+    """Convert an fs path to a s3 key below ``prefix``."""
+    _path = "{}/{}".format(prefix, relpath(normpath(path)))
+    if is_dir:
+        _path = forcedir(_path)
+    return _path.lstrip("/").replace("/", delimiter)
+
+
+def _dt_utc_epoch(dt):
+    """Convert a tz-aware datetime (as returned by minio) to epoch."""
+    return int(dt.timestamp()) if dt is not None else None
 
 
 def _make_repr(class_name, *args, **kwargs):
@@ -62,15 +85,22 @@ class S3File(io.IOBase):
     """Proxy for a S3 file."""
 
     @classmethod
-    def factory(cls, filename, mode, on_close):
-        """Create a S3File backed with a temporary file."""
-        _temp_file = tempfile.TemporaryFile()
+    def factory(cls, filename, mode, on_close, spool_size=0):
+        """Create a S3File backed with a temporary file.
+
+        If ``spool_size`` is set, the data is kept in memory until it
+        grows larger than ``spool_size`` bytes.
+        """
+        if spool_size:
+            _temp_file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        else:
+            _temp_file = tempfile.TemporaryFile()
         proxy = cls(_temp_file, filename, mode, on_close=on_close)
         return proxy
 
     def __repr__(self):
         return _make_repr(
-            self.__class__.__name__, self.__filename, text_type(self.__mode)
+            self.__class__.__name__, self.__filename, str(self.__mode)
         )
 
     def __init__(self, f, filename, mode, on_close=None):
@@ -152,6 +182,11 @@ class S3File(io.IOBase):
         return self._f.readall()
 
     def readinto(self, b):
+        if not hasattr(self._f, "readinto"):
+            # SpooledTemporaryFile before Python 3.11
+            data = self._f.read(len(b))
+            b[:len(data)] = data
+            return len(data)
         return self._f.readinto(b)
 
     def write(self, b):
@@ -164,6 +199,13 @@ class S3File(io.IOBase):
         if size is None:
             size = self._f.tell()
         self._f.truncate(size)
+        padding = size - self.length
+        if padding > 0:
+            # Unlike files, in-memory buffers aren't extended by truncate.
+            current_offset = self._f.tell()
+            self._f.seek(0, os.SEEK_END)
+            self._f.write(b"\0" * padding)
+            self._f.seek(current_offset, os.SEEK_SET)
         return size
 
     @property
@@ -179,12 +221,25 @@ class S3File(io.IOBase):
         return self.__mode
 
 
-@contextlib.contextmanager
-def minioerrors(path):
-    """Translate S3 errors to FSErrors."""
-    try:
-        yield
-    except S3Error as error:
+class _MinioErrors:
+    """Translate S3 errors to FSErrors.
+
+    A plain context manager class, as it wraps every request and is
+    cheaper to enter than a generator based one.
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, error, traceback):
+        if exc_type is None or not issubclass(exc_type, S3Error):
+            return False
+        path = self.path
         error_code = error.code
         error_msg = error.message
         http_status = error.response.status
@@ -199,7 +254,23 @@ def minioerrors(path):
             raise errors.OperationFailed(path=path, exc=error)
 
 
-@six.python_2_unicode_compatible
+class _SharedPoolMinio(minio.Minio):
+    """A minio client that leaves its http pool open when deleted.
+
+    ``minio.Minio`` clears its pool on ``__del__``, which would close the
+    connections of a pool the caller passed in and may share.
+    """
+
+    def __del__(self):
+        pass
+
+
+class _ObjectChanged(errors.OperationFailed):
+    """An object changed while it was downloaded in parts."""
+
+    default_message = "object changed during download: '{path}'"
+
+
 class S3FS(FS):
     """
     Construct an Amazon S3 filesystem for
@@ -216,6 +287,8 @@ class S3FS(FS):
         default).
     :param str aws_session_token:
     :param str region: Optional S3 region.
+    :param http_client: A ``urllib3.PoolManager`` shared by the minio
+        clients, or ``None`` to create one.
     :param str delimiter: The delimiter to separate folders, defaults to
         a forward slash.
     :param bool strict: When ``True`` (default) S3FS will follow the
@@ -229,6 +302,17 @@ class S3FS(FS):
         for details.
     :param dict download_args: Dictionary of extra arguments passed to
         the S3 client.
+    :param float cache_ttl: Number of seconds object metadata (including
+        "not found" results) is cached for, or ``0`` to disable the
+        cache. Defaults to ``2.0``.
+    :param int spool_size: Files opened with ``openbin`` are buffered in
+        memory, rather than in a temporary file, until they are larger
+        than this many bytes. Defaults to ``0`` (always use a temporary
+        file).
+    :param bool prewarm: Open a few pooled connections to the endpoint
+        when the filesystem is created, so the first requests don't pay
+        for connection setup. This gives up after a couple of seconds.
+        Defaults to ``True``.
 
     """
 
@@ -260,8 +344,28 @@ class S3FS(FS):
         "version_id"
     ]
 
+    # (name, is a datetime) pairs, so listings don't type check every value.
+    _s3_attributes = tuple(
+        (name, name == "last_modified") for name in _object_attributes
+    )
+
     _dir_mark = ".pyfs.isdir"
 
+    _stat_cache_size = 1024
+
+    _copy_buffer_size = 1024 * 1024
+
+    # minio rejects upload parts under 5 MiB
+    _part_size = 8 * 1024 * 1024
+
+    _download_part_size = 8 * 1024 * 1024
+
+    _max_parallel_uploads = 16
+
+    _max_parallel_downloads = 16
+
+    _prewarm_timeout = 2.0
+
     def __init__(
             self,
             bucket_name,
@@ -276,6 +380,9 @@ class S3FS(FS):
             strict=True,
             upload_args=None,
             download_args=None,
+            cache_ttl=2.0,
+            spool_size=0,
+            prewarm=True,
     ):
         if download_args is None:
             self._download_args = {"request_headers": None}
@@ -299,14 +406,40 @@ class S3FS(FS):
         self.secret_key = secret_key
         self.secure = secure
         self.region = region
+        self._owns_http_client = http_client is None
+        if http_client is None:
+            # One pool for the client shared by every thread, sized for the
+            # parallel part uploads / downloads.
+            timeout = timedelta(minutes=5).seconds
+            http_client = urllib3.PoolManager(
+                num_pools=16,
+                maxsize=64,
+                block=False,
+                timeout=urllib3.Timeout(connect=timeout, read=timeout),
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=urllib3.Retry(
+                    total=5,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504],
+                ),
+            )
         self.http_client = http_client
 
         self.delimiter = delimiter
         self.strict = strict
-        self._tlocal = threading.local()
+        self.cache_ttl = cache_ttl
+        self.spool_size = spool_size
+        self._stat_cache = OrderedDict()
+        self._stat_cache_lock = threading.Lock()
+        self._minio = None
+        self._minio_lock = threading.Lock()
 
         super(S3FS, self).__init__()
 
+        if prewarm and endpoint:
+            self._prewarm(min(8, os.cpu_count() or 1))
+
     def __repr__(self):
         return _make_repr(
             self.__class__.__name__,
@@ -321,60 +454,348 @@ class S3FS(FS):
 
     def _path_to_key(self, path) -> str:
         """Converts an fs path to a s3 key."""
-        _path = relpath(normpath(path))
-        _key = (
-            "{}/{}".format(self._prefix, _path).lstrip("/").replace("/", self.delimiter)
-        )
-        return _key
+        return _convert_path_to_key(self._prefix, self.delimiter, path)
 
     def _path_to_dir_key(self, path) -> str:
         """Converts an fs path to a s3 key."""
-        _path = relpath(normpath(path))
-        _key = (
-            forcedir("{}/{}".format(self._prefix, _path))
-                .lstrip("/")
-                .replace("/", self.delimiter)
-        )
-        return _key
+        return _convert_path_to_key(self._prefix, self.delimiter, path, True)
 
     def _key_to_path(self, key) -> str:
         return key.replace(self.delimiter, "/")
 
-    def _minio_stat_object(self, path, key) -> minioObject:
+    def _cache_stat(self, key, obj, listed=False):
+        """Cache an object (or ``None`` for a missing key).
+
+        Set ``listed`` for objects from a listing, which lack the content
+        type and metadata of a stat.
+        """
+        if not self.cache_ttl:
+            return
+        cache_key = (self._bucket_name, key)
+        with self._stat_cache_lock:
+            self._stat_cache[cache_key] = (
+                obj, monotonic() + self.cache_ttl, listed
+            )
+            self._stat_cache.move_to_end(cache_key)
+            if len(self._stat_cache) > self._stat_cache_size:
+                self._stat_cache.popitem(last=False)
+
+    def _invalidate(self, key, recursive=False):
+        """Forget cached metadata for a key that is being modified.
+
+        Ancestors are dropped too, since writing or removing a key can
+        implicitly create or remove its parent directories. Set
+        ``recursive`` to also drop everything below ``key``.
+        """
+        _key = key.rstrip(self.delimiter)
+        with self._stat_cache_lock:
+            if recursive:
+                prefix = forcedir(_key) if _key else ""
+                for cache_key in list(self._stat_cache):
+                    if cache_key[1].startswith(prefix):
+                        del self._stat_cache[cache_key]
+            while _key:
+                self._stat_cache.pop((self._bucket_name, _key), None)
+                _key = _key.rpartition(self.delimiter)[0]
+
+    def _lookup_object(self, key, listed=True):
+        """Look up a key in the cached object metadata.
+
+        Returns a ``(hit, obj)`` tuple, where ``obj`` is ``None`` if the
+        key is known not to exist. Objects from listings are skipped
+        unless ``listed`` is set.
+        """
+        if self.cache_ttl:
+            with self._stat_cache_lock:
+                cached = self._stat_cache.get((self._bucket_name, key))
+            if cached is not None and cached[1] > monotonic():
+                obj, _expires, from_listing = cached
+                if listed or obj is None or not from_listing:
+                    return True, obj
+        return False, None
+
+    def _minio_stat_object(
+            self, path, key, _prefetched=None, listed=True
+    ) -> minioObject:
+        if _prefetched is not None:
+            return _prefetched
+        _key = key.rstrip(self.delimiter)
+        hit, obj = self._lookup_object(_key, listed=listed)
+        if not hit:
+            obj = self._fetch_object(path, _key)
+            self._cache_stat(_key, obj)
+        if obj is None:
+            raise errors.ResourceNotFound(path)
+        return obj
+
+    def _probe_key(self, path, key, use_cache=True) -> Optional[minioObject]:
+        """Get a file or directory object with a single list request.
+
+        Returns ``None`` if nothing exists at ``key``.
+        """
         _key = key.rstrip(self.delimiter)
-        with minioerrors(path):
+        hit, obj = self._lookup_object(_key) if use_cache else (False, None)
+        if not hit:
+            obj = self._list_object(path, _key)
+            self._cache_stat(_key, obj, listed=True)
+        return obj
+
+    def _exists_key(self, path, key) -> bool:
+        """Check a key exists, without validating or converting a path."""
+        return self._probe_key(path, key) is not None
+
+    def _fetch_object(self, path, _key) -> Optional[minioObject]:
+        with _MinioErrors(path):
             try:
                 return self.minio.stat_object(
                     self.bucket_name,
                     _key,
                 )
             except S3Error:
-                current_dir = list(filter(lambda x: x.object_name.rstrip(self.delimiter) == _key, self.minio.list_objects(self.bucket_name, _key)))
-                if not current_dir:
-                    raise errors.ResourceNotFound(path)
-                return current_dir[0]
+                return self._list_object(path, _key)
+
+    def _list_object(self, path, _key) -> Optional[minioObject]:
+        # A non-recursive listing returns the file itself and / or the
+        # directory as a common prefix, so one request answers both.
+        dir_key = _key + self.delimiter
+        with _MinioErrors(path):
+            for obj in self.minio.list_objects(
+                    self.bucket_name,
+                    prefix=_key,
+                    recursive=False,
+            ):
+                if obj.object_name in (_key, dir_key):
+                    return obj
+        return None
+
+    def _get_range(self, path, key, offset, length, etag) -> bytes:
+        """Get part of an object, if it still has the given ETag."""
+        download_args = dict(self._download_args)
+        request_headers = dict(download_args.get("request_headers") or {})
+        request_headers["If-Match"] = '"{}"'.format(etag)
+        download_args["request_headers"] = request_headers
+        with _MinioErrors(path):
+            try:
+                response = self.minio.get_object(
+                    self._bucket_name,
+                    key,
+                    offset=offset,
+                    length=length,
+                    **download_args
+                )
+            except S3Error as error:
+                if error.response.status == 412:
+                    raise _ObjectChanged(path=path, exc=error)
+                raise
+            try:
+                data = response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        if len(data) != length:
+            raise _ObjectChanged(path=path)
+        return data
+
+    def _stat_ranged(self, path, key, size) -> Optional[minioObject]:
+        """Stat an object afresh, if its size hint spans several parts.
+
+        Returns ``None`` if the object fits in a single GET. The parts of
+        a ranged download must all come from the object version returned
+        here, so cached metadata won't do.
+        """
+        if size is None or size <= self._download_part_size:
+            return None
+        with _MinioErrors(path):
+            obj = self.minio.stat_object(self._bucket_name, key)
+        self._cache_stat(key, obj)
+        if obj.size <= self._download_part_size:
+            return None
+        return obj
+
+    def _iter_ranges(self, path, key, size, etag):
+        """Download an object with concurrent ranged GETs.
+
+        Yields the parts in order, keeping at most one part per worker
+        in flight. Raises ``_ObjectChanged`` if the object no longer has
+        the ``etag``.
+        """
+        offsets = range(0, size, self._download_part_size)
+        workers = min(self._max_parallel_downloads, len(offsets))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = deque()
+            for offset in offsets:
+                futures.append(
+                    executor.submit(
+                        self._get_range,
+                        path,
+                        key,
+                        offset,
+                        min(self._download_part_size, size - offset),
+                        etag,
+                    )
+                )
+                if len(futures) >= workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    def _download_to(self, path, key, file, chunk_size=None, size=None):
+        """Stream an object in to a binary file object.
+
+        If the object ``size`` is known and spans multiple parts, the
+        parts are fetched concurrently.
+        """
+        obj = self._stat_ranged(path, key, size)
+        if obj is not None:
+            for data in self._iter_ranges(path, key, obj.size, obj.etag):
+                file.write(data)
+            return
+        with _MinioErrors(path):
+            response = self.minio.get_object(
+                self._bucket_name,
+                key,
+                **self._download_args
+            )
+            try:
+                shutil.copyfileobj(
+                    response, file, chunk_size or self._copy_buffer_size
+                )
+            finally:
+                response.close()
+                response.release_conn()
+
+    def _upload_from(self, path, key, file, length):
+        """Upload a binary file object, in parallel parts if it is large."""
+        with _MinioErrors(path):
+            self.minio.put_object(
+                self._bucket_name,
+                key,
+                file,
+                length,
+                part_size=self._part_size,
+                num_parallel_uploads=min(
+                    self._max_parallel_uploads, os.cpu_count() or 1
+                ),
+                **self._get_upload_args(key)
+            )
+
+    def _write_key(self, path, key, file, length):
+        """Upload to a key, forgetting its cached metadata.
+
+        The cache is cleared again once the upload is done, since another
+        thread may have looked the key up while it was in flight.
+        """
+        self._invalidate(key)
+        try:
+            self._upload_from(path, key, file, length)
+        finally:
+            self._invalidate(key)
+
+    def _remove_keys(self, path, keys):
+        """Delete keys with batched (up to 1000 per request) deletes."""
+        with _MinioErrors(path):
+            for error in self.minio.remove_objects(
+                    self.bucket_name,
+                    (DeleteObject(key) for key in keys),
+            ):
+                raise errors.OperationFailed(path=path, msg=error.message)
 
+    def _remove_prefix(self, path, prefix, exclude=()):
+        """Delete every object below a key prefix."""
+        self._invalidate(prefix, recursive=True)
+        try:
+            self._remove_keys(
+                path,
+                (
+                    obj.object_name
+                    for obj in self.minio.list_objects(
+                        self.bucket_name,
+                        prefix=prefix,
+                        recursive=True,
+                    )
+                    if obj.object_name not in exclude
+                ),
+            )
+        finally:
+            self._invalidate(prefix, recursive=True)
 
     def _get_upload_args(self, key) -> dict:
         upload_args = self._upload_args.copy()
 
         if not upload_args.get("content_type"):
-            mime_type, _encoding = mimetypes.guess_type(key)
-            upload_args["content_type"] = mime_type or "binary/octet-stream"
+            ext = os.path.splitext(key)[1].lower()
+            if ext in mimetypes.encodings_map:
+                # e.g. ".tar.gz", the type depends on the previous extension
+                mime_type, _encoding = mimetypes.guess_type(key)
+                upload_args["content_type"] = mime_type or "binary/octet-stream"
+            else:
+                upload_args["content_type"] = _guess_content_type(ext)
 
         return upload_args
 
     @property
     def minio(self) -> minio.Minio:
-        if not hasattr(self._tlocal, "minio"):
-            self._tlocal.minio = minio.Minio(
-                self.endpoint,
-                access_key=self.access_key,
-                secret_key=self.secret_key,
-                secure=self.secure,
-                http_client=self.http_client,
+        """The minio client, shared by every thread (it is thread safe)."""
+        client = self._minio
+        if client is None:
+            with self._minio_lock:
+                if self._minio is None:
+                    client_class = (
+                        minio.Minio
+                        if self._owns_http_client
+                        else _SharedPoolMinio
+                    )
+                    self._minio = client_class(
+                        self.endpoint,
+                        access_key=self.access_key,
+                        secret_key=self.secret_key,
+                        secure=self.secure,
+                        region=self.region,
+                        http_client=self.http_client,
+                    )
+                client = self._minio
+        return client
+
+    def _prewarm(self, connections):
+        """Open pooled connections up front with concurrent cheap requests.
+
+        This is best effort; errors are left for the first real request.
+        The requests are unsigned HEADs sent straight through the pool,
+        with a short timeout and no retries.
+        """
+        # Build the bucket URL the way the client does, so the same
+        # (possibly virtual host style) pool gets warmed.
+        base_url = self.minio._base_url
+        if base_url.is_aws_host and not base_url.region:
+            return  # the host depends on a region that isn't known yet
+        url = urlunsplit(
+            base_url.build(
+                method="HEAD",
+                region=base_url.region or "us-east-1",
+                bucket_name=self._bucket_name,
             )
-        return self._tlocal.minio
+        )
+        timeout = urllib3.Timeout(
+            connect=self._prewarm_timeout, read=self._prewarm_timeout
+        )
+
+        def warm():
+            try:
+                self.http_client.request(
+                    "HEAD", url, timeout=timeout, retries=False
+                )
+            except Exception:
+                pass
+
+        threads = [
+            threading.Thread(target=warm, daemon=True)
+            for _ in range(connections)
+        ]
+        for thread in threads:
+            thread.start()
+        deadline = monotonic() + self._prewarm_timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - monotonic()))
 
     def _extract_info_from_minio_object(self, obj: minioObject, namespaces) -> dict:
         """Make an info dict from an s3 Object."""
@@ -388,22 +809,22 @@ class S3FS(FS):
             _type = int(ResourceType.directory if is_dir else ResourceType.file)
             info["details"] = {
                 "accessed": None,
-                "modified": datetime_to_epoch(obj.last_modified) if obj.last_modified else None,
+                "modified": _dt_utc_epoch(obj.last_modified),
                 "size": obj.size,
                 "type": _type,
             }
 
         if "s3" in namespaces:
             s3info = info["s3"] = {}
-            for name in self._object_attributes:
+            for name, is_datetime in self._s3_attributes:
                 value = getattr(obj, name, None)
-                if isinstance(value, datetime):
-                    value = datetime_to_epoch(value)
+                if is_datetime:
+                    value = _dt_utc_epoch(value)
                 s3info[name] = value
 
         return info
 
-    def getinfo(self, path, namespaces=None) -> Info:
+    def getinfo(self, path, namespaces=None, _prefetched=None) -> Info:
         namespaces = namespaces or ()
         _path = self.validatepath(path)
         _key = self._path_to_key(_path)
@@ -416,7 +837,10 @@ class S3FS(FS):
                 }
             )
 
-        obj = self._minio_stat_object(path, _key)
+        # Listings don't include the content type or metadata.
+        obj = self._minio_stat_object(
+            path, _key, _prefetched=_prefetched, listed="s3" not in namespaces
+        )
         info = self._extract_info_from_minio_object(obj, namespaces)
         return Info(info)
 
@@ -425,50 +849,65 @@ class S3FS(FS):
         _s3_key = self._path_to_dir_key(_path)
 
         dirs = []
-        with minioerrors(path):
-            objects_list = list(self.minio.list_objects(
-                self.bucket_name,
-                prefix=_s3_key,
-                recursive=False,
-            ))
-            if not objects_list and _s3_key != "":
-                if self.getinfo(path).is_file:
-                    raise errors.DirectoryExpected(path)
-                raise errors.ResourceNotFound(path)
-            for obj in objects_list:
+        # The directory exists if anything, including its marker, is listed.
+        listed = False
+        with _MinioErrors(path):
+            for obj in self.minio.list_objects(
+                    self.bucket_name,
+                    prefix=_s3_key,
+                    recursive=False,
+            ):
+                listed = True
                 if obj.object_name.endswith(self._dir_mark):
                     continue
-                key = basename(obj.object_name.rstrip("/"))
-
-                dirs.append(key)
+                dirs.append(basename(obj.object_name.rstrip("/")))
 
-        if len(dirs) == 1 and not self.getinfo(path).is_dir:
-            raise NotADirectoryError(path)
+        if not listed and _s3_key != "":
+            if self.getinfo(path).is_file:
+                raise errors.DirectoryExpected(path)
+            raise errors.ResourceNotFound(path)
 
         return dirs
 
     def makedir(self, path, permissions=None, recreate=False):
-        self.check()
         _path = self.validatepath(path)
         _key = self._path_to_dir_key(_path)
 
         # 检查父文件夹是否存在
-        if not self.isdir(dirname(_path)):
-            raise errors.ResourceNotFound(path)
+        dir_path = dirname(_path)
+        if dir_path != "/":
+            parent = self._probe_key(dir_path, self._path_to_dir_key(dir_path))
+            if parent is None or not parent.is_dir:
+                raise errors.ResourceNotFound(path)
 
         file_mark = join(_key, self._dir_mark)  # 在目录下创建一个 mark 文件，表示目录被生成
 
         # 标记文件已存在
-        if not recreate and (self.exists(file_mark) or self.exists(path)):
+        # Not cached: skipping the marker on stale metadata would persist.
+        obj = self._probe_key(path, _key, use_cache=False) if _key else None
+        if not recreate and (_path == "/" or obj is not None):
             raise errors.DirectoryExists(path)
 
-        else:
-            with minioerrors(path):
-                self.minio.put_object(
-                    self.bucket_name,
-                    file_mark,
-                    io.BytesIO(b""),
-                    length=0,
+        # A directory with contents is listed without a marker, so only
+        # write one when the directory doesn't show up yet.
+        if obj is None or not obj.is_dir:
+            self._invalidate(_key)
+            try:
+                with _MinioErrors(path):
+                    self.minio.put_object(
+                        self.bucket_name,
+                        file_mark,
+                        io.BytesIO(b""),
+                        length=0,
+                    )
+            finally:
+                self._invalidate(_key)
+            if _key:
+                # so opendir doesn't need to look the new directory up
+                self._cache_stat(
+                    _key.rstrip(self.delimiter),
+                    minioObject(self._bucket_name, _key),
+                    listed=True,
                 )
 
         return self.opendir(path)
@@ -477,7 +916,6 @@ class S3FS(FS):
         mode = mode if "b" in mode else mode + "b"
         _mode = Mode(mode)
         _mode.validate_bin()
-        self.check()
         _path = self.validatepath(path)
         _key = self._path_to_key(_path)
         #
@@ -508,44 +946,31 @@ class S3FS(FS):
                 """Called when the S3 file closes, to upload data."""
                 try:
                     s3file.raw.seek(0)
-                    with minioerrors(path):
-                        self.minio.put_object(
-                            self._bucket_name,
-                            _key,
-                            s3file.raw,
-                            s3file.length,
-                            **self._get_upload_args(_key)
-                        )
+                    self._write_key(path, _key, s3file.raw, s3file.length)
                 finally:
                     s3file.raw.close()
 
-            try:
+            if self.strict:
                 dir_path = dirname(_path)
                 if dir_path != "/":
                     _dir_key = self._path_to_dir_key(dir_path)
-                    self._minio_stat_object(dir_path, _dir_key)
-            except errors.ResourceNotFound:
-                raise errors.ResourceNotFound(path)
-
-            try:
-                info = self.getinfo(path)
-            except errors.ResourceNotFound:
-                pass
-            else:
-                if _mode.exclusive:
-                    raise errors.FileExists(path)
-                if info.is_dir:
-                    raise errors.FileExpected(path)
-
-            s3file = S3File.factory(path, _mode, on_close=on_close_create)
+                    if not self._exists_key(dir_path, _dir_key):
+                        raise errors.ResourceNotFound(path)
+
+            if self.strict or _mode.exclusive:
+                obj = self._probe_key(path, _key)
+                if obj is not None:
+                    if _mode.exclusive:
+                        raise errors.FileExists(path)
+                    if obj.is_dir:
+                        raise errors.FileExpected(path)
+
+            s3file = S3File.factory(
+                path, _mode, on_close=on_close_create, spool_size=self.spool_size
+            )
             if _mode.appending:
                 try:
-                    with minioerrors(path):
-                        s3file.raw.write(self.minio.get_object(
-                            self._bucket_name,
-                            _key,
-                            **self._download_args
-                        ).read())
+                    self._download_to(path, _key, s3file.raw)
                 except errors.ResourceNotFound:
                     pass
                 else:
@@ -563,103 +988,115 @@ class S3FS(FS):
             try:
                 if _mode.writing:
                     s3file.raw.seek(0, os.SEEK_SET)
-                    with minioerrors(path):
-                        self.minio.put_object(
-                            self._bucket_name,
-                            _key,
-                            s3file.raw,
-                            s3file.length,
-                            **self._get_upload_args(_key)
-                        )
+                    self._write_key(path, _key, s3file.raw, s3file.length)
             finally:
                 s3file.raw.close()
 
-        s3file = S3File.factory(path, _mode, on_close=on_close)
-        with minioerrors(path):
-            s3file.raw.write(self.minio.get_object(
-                self._bucket_name,
-                _key,
-                **self._download_args
-            ).read())
+        s3file = S3File.factory(
+            path, _mode, on_close=on_close, spool_size=self.spool_size
+        )
+        self._download_to(path, _key, s3file.raw)
         s3file.seek(0, os.SEEK_SET)
         return s3file
 
     def remove(self, path):
-        self.check()
         _path = self.validatepath(path)
         _key = self._path_to_key(_path)
         if self.strict:
             info = self.getinfo(path)
             if info.is_dir:
                 raise errors.FileExpected(path)
-        self.minio.remove_object(self._bucket_name, _key)
+        self._invalidate(_key)
+        try:
+            self.minio.remove_object(self._bucket_name, _key)
+        finally:
+            self._invalidate(_key)
 
     def isempty(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_dir_key(_path)
         return self.listdir(path) == []
 
     def removedir(self, path):
-        self.check()
         _path = self.validatepath(path)
         if _path == "/":
             raise errors.RemoveRootError()
-        info = self.getinfo(_path)
-        if not info.is_dir:
+        _key = self._path_to_dir_key(_path)
+        obj = self._probe_key(path, _key)
+        if obj is None:
+            raise errors.ResourceNotFound(path)
+        if not obj.is_dir:
             raise errors.DirectoryExpected(path)
         if not self.isempty(path):
             raise errors.DirectoryNotEmpty(path)
+        self._invalidate(_key)
+        try:
+            # Also remove a "folder" object other S3 tools may have created.
+            self._remove_keys(path, [join(_key, self._dir_mark), _key])
+        finally:
+            self._invalidate(_key)
+
+    def removetree(self, dir_path):
+        _path = self.validatepath(dir_path)
         _key = self._path_to_dir_key(_path)
-        self.minio.remove_object(self._bucket_name, join(_key, self._dir_mark))
+        if _path == "/":
+            # Keep the root directory itself.
+            self._remove_prefix(
+                dir_path, _key, exclude=(join(_key, self._dir_mark), _key)
+            )
+            return
+        info = self.getinfo(_path)
+        if not info.is_dir:
+            raise errors.DirectoryExpected(dir_path)
+        self._remove_prefix(dir_path, _key)
 
     def setinfo(self, path, info):
         self.getinfo(path)
 
     def readbytes(self, path):
-        self.check()
+        _path = self.validatepath(path)
+        _key = self._path_to_key(_path)
+        size = None
         if self.strict:
-            info = self.getinfo(path)
+            info = self.getinfo(path, namespaces=["details"])
             if not info.is_file:
                 raise errors.FileExpected(path)
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        bytes_file = io.BytesIO()
-        with minioerrors(path):
-            bytes_file.write(self.minio.get_object(
+            size = info.size
+        obj = self._stat_ranged(path, _key, size)
+        if obj is not None:
+            try:
+                return b"".join(
+                    self._iter_ranges(path, _key, obj.size, obj.etag)
+                )
+            except _ObjectChanged:
+                pass  # overwritten meanwhile, read it in a single GET
+        with _MinioErrors(path):
+            response = self.minio.get_object(
                 self._bucket_name,
                 _key,
                 **self._download_args
-            ).read())
-        return bytes_file.getvalue()
+            )
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
 
     def download(self, path, file, chunk_size=None, **options):
-        self.check()
+        _path = self.validatepath(path)
+        _key = self._path_to_key(_path)
+        size = None
         if self.strict:
-            info = self.getinfo(path)
+            info = self.getinfo(path, namespaces=["details"])
             if not info.is_file:
                 raise errors.FileExpected(path)
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        with minioerrors(path):
-            file.write(self.minio.get_object(
-                self._bucket_name,
-                _key,
-                **self._download_args
-            ).read())
+            size = info.size
+        self._download_to(path, _key, file, chunk_size, size=size)
 
     def exists(self, path):
-        self.check()
         _path = self.validatepath(path)
         if _path == "/":
             return True
         _key = self._path_to_dir_key(_path)
-        try:
-            self._minio_stat_object(path, _key)
-        except errors.ResourceNotFound:
-            return False
-        else:
-            return True
+        return self._probe_key(path, _key) is not None
 
     def scandir(self, path, namespaces=None, page=None):
         _path = self.validatepath(path)
@@ -671,7 +1108,7 @@ class S3FS(FS):
             raise errors.DirectoryExpected(path)
 
         def gen_info():
-            with minioerrors(path):
+            with _MinioErrors(path):
                 for obj in self.minio.list_objects(
                         self.bucket_name,
                         prefix=_s3_key,
@@ -679,6 +1116,11 @@ class S3FS(FS):
                 ):
                     if obj.object_name.endswith(self._dir_mark):
                         continue
+                    # so getinfo / exists calls made while walking this
+                    # directory don't need another request
+                    self._cache_stat(
+                        obj.object_name.rstrip(self.delimiter), obj, listed=True
+                    )
                     yield Info(self._extract_info_from_minio_object(obj, namespaces))
 
         iter_info = iter(gen_info())
@@ -705,38 +1147,35 @@ class S3FS(FS):
             except errors.ResourceNotFound:
                 pass
 
+        # BytesIO shares the bytes object's buffer until it is written to,
+        # and a single-part upload reads the same object back, so this
+        # doesn't copy the contents.
         bytes_file = io.BytesIO(contents)
-        with minioerrors(path):
-            self.minio.put_object(
-                self._bucket_name,
-                _key,
-                bytes_file,
-                len(contents),
-                **self._get_upload_args(_key)
-            )
+        self._write_key(path, _key, bytes_file, len(contents))
 
-    # def upload(self, path, file, chunk_size=None, **options):
-    #     _path = self.validatepath(path)
-    #     _key = self._path_to_key(_path)
-    #
-    #     if self.strict:
-    #         if not self.isdir(dirname(path)):
-    #             raise errors.ResourceNotFound(path)
-    #         try:
-    #             info = self._getinfo(path)
-    #             if info.is_dir:
-    #                 raise errors.FileExpected(path)
-    #         except errors.ResourceNotFound:
-    #             pass
-    #
-    #     with minioerrors(path):
-    #         self.minio.put_object(
-    #             self._bucket_name,
-    #             _key,
-    #             file,
-    #             file.
-    #             **self._get_upload_args(_key)
-    #         )
+    def upload(self, path, file, chunk_size=None, **options):
+        _path = self.validatepath(path)
+        _key = self._path_to_key(_path)
+
+        if self.strict:
+            if not self.isdir(dirname(path)):
+                raise errors.ResourceNotFound(path)
+            try:
+                info = self.getinfo(path)
+                if info.is_dir:
+                    raise errors.FileExpected(path)
+            except errors.ResourceNotFound:
+                pass
+
+        # Stream straight from the file, rather than spooling it to a
+        # temporary file through openbin first.
+        try:
+            start = file.tell()
+            length = file.seek(0, os.SEEK_END) - start
+            file.seek(start, os.SEEK_SET)
+        except (AttributeError, OSError):
+            length = -1  # not seekable, minio uploads it in parts
+        self._write_key(path, _key, file, length)
 
     # def copy(self, src_path, dst_path, overwrite=False):
     #     if not overwrite and self.exists(dst_path):
@@ -1,10 +1,6 @@
 # coding: utf-8
 """Defines the S3FS Opener."""
 
-from __future__ import absolute_import
-from __future__ import print_function
-from __future__ import unicode_literals
-
 __all__ = ["S3FSOpener"]
 
 from fs.opener import Opener
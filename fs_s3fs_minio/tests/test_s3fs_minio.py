@@ -1,25 +1,60 @@
-from __future__ import unicode_literals
-
+import time
 import unittest
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
 import minio
+from minio import S3Error
+from minio.datatypes import Object as minioObject
+from minio.deleteobjects import DeleteObject
 from nose.plugins.attrib import attr
+import urllib3
 
+from fs import errors
+from fs.mode import Mode
 from fs.test import FSTestCases
+from fs.time import datetime_to_epoch
 from fs_s3fs_minio import S3FS
+from fs_s3fs_minio._s3fs_minio import S3File, _dt_utc_epoch
+
+
+# Shared by every test, so connections stay warm between tests.
+_SHARED_HTTP = urllib3.PoolManager(maxsize=32, block=False)
+
+_CLIENT = minio.Minio(
+    endpoint="localhost:9000",
+    region="us-west-2",
+    access_key="minio",
+    secret_key="minio123",
+    secure=False,
+    http_client=_SHARED_HTTP,
+)
+
+
+def delete_bucket_contents(client, bucket_name):
+    """Delete every object in a bucket with batched deletes."""
+    names = [
+        obj.object_name
+        for obj in client.list_objects(bucket_name, recursive=True)
+    ]
+    try:
+        for error in client.remove_objects(
+            bucket_name, (DeleteObject(name) for name in names)
+        ):
+            raise AssertionError(error)
+    except S3Error:
+        # server without multi-object delete
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(partial(client.remove_object, bucket_name), names))
 
 
 class TestS3FS(FSTestCases, unittest.TestCase):
     """Test S3FS implementation from dir_path."""
 
     bucket_name = "fs-minio-test"
-    client = minio.Minio(
-        endpoint="localhost:9000",
-        region="us-west-2",
-        access_key="minio",
-        secret_key="minio123",
-        secure=False
-    )
+    client = _CLIENT
 
     def make_fs(self):
         self._delete_bucket_contents()
@@ -29,11 +64,44 @@ class TestS3FS(FSTestCases, unittest.TestCase):
             access_key="minio",
             secret_key="minio123",
             endpoint="localhost:9000",
+            http_client=_SHARED_HTTP,
         )
 
     def _delete_bucket_contents(self):
-        for exist_object in self.client.list_objects(self.bucket_name, recursive=True):
-            self.client.remove_object(exist_object.bucket_name, exist_object.object_name)
+        delete_bucket_contents(self.client, self.bucket_name)
+
+    def test_shared_pool_kept(self):
+        # Deleting a filesystem leaves connections in a pool passed in.
+        pool = urllib3.PoolManager()
+        s3 = S3FS(
+            self.bucket_name,
+            region="us-west-2",
+            access_key="minio",
+            secret_key="minio123",
+            endpoint="localhost:9000",
+            http_client=pool,
+        )
+        s3.exists("foo")
+        del s3
+        self.assertEqual(len(pool.pools), 1)
+
+    def test_readbytes_overwritten(self):
+        # Ranged reads use a fresh size, not one cached before a rewrite.
+        other = self.make_fs()
+        self.fs._download_part_size = 1024
+        self.fs.writebytes("big", b"a" * 1500)
+        self.assertEqual(self.fs.getinfo("big", ["details"]).size, 1500)
+        other.writebytes("big", b"b" * 3000)
+        self.assertEqual(self.fs.readbytes("big"), b"b" * 3000)
+
+
+class TestS3FSSpooled(TestS3FS):
+    """Test S3FS implementation with files spooled in memory."""
+
+    def make_fs(self):
+        s3 = super().make_fs()
+        s3.spool_size = 64  # small, so tests cover both rolled and not
+        return s3
 
 
 @attr("slow")
@@ -41,19 +109,15 @@ class TestS3FSSubDir(FSTestCases, unittest.TestCase):
     """Test S3FS implementation from dir_path."""
 
     bucket_name = "fs-minio-test"
-    client = minio.Minio(
-        endpoint="localhost:9000",
-        region="us-west-2",
-        access_key="minio",
-        secret_key="minio123",
-        secure=False
-    )
+    client = _CLIENT
     s3 = S3FS(
         bucket_name,
         region="us-west-2",
         access_key="minio",
         secret_key="minio123",
         endpoint="localhost:9000",
+        http_client=_SHARED_HTTP,
+        prewarm=False,  # built at import time
     )
 
     def make_fs(self):
@@ -65,11 +129,11 @@ class TestS3FSSubDir(FSTestCases, unittest.TestCase):
             access_key="minio",
             secret_key="minio123",
             endpoint="localhost:9000",
+            http_client=_SHARED_HTTP,
         )
 
     def _delete_bucket_contents(self):
-        for exist_object in self.client.list_objects(self.bucket_name, recursive=True):
-            self.client.remove_object(exist_object.bucket_name, exist_object.object_name)
+        delete_bucket_contents(self.client, self.bucket_name)
 
 
 class TestS3FSHelpers(unittest.TestCase):
@@ -83,21 +147,103 @@ class TestS3FSHelpers(unittest.TestCase):
         self.assertEqual(s3._path_to_key("foo.bar"), "dir/foo.bar")
         self.assertEqual(s3._path_to_key("foo/bar"), "dir/foo/bar")
 
-    def test_upload_args(self):
-        s3 = S3FS("foo", acl="acl", cache_control="cc")
-        self.assertDictEqual(
-            s3._get_upload_args("test.jpg"),
-            {"ACL": "acl", "CacheControl": "cc", "ContentType": "image/jpeg"},
-        )
-        self.assertDictEqual(
-            s3._get_upload_args("test.mp3"),
-            {"ACL": "acl", "CacheControl": "cc", "ContentType": "audio/mpeg"},
-        )
-        self.assertDictEqual(
-            s3._get_upload_args("test.json"),
-            {"ACL": "acl", "CacheControl": "cc", "ContentType": "application/json"},
+    def test_path_to_key_no_cycle(self):
+        # The key cache mustn't keep the filesystem (and its pool) alive.
+        s3 = S3FS("foo", "/dir")
+        s3._path_to_key("foo.bar")
+        ref = weakref.ref(s3)
+        del s3
+        self.assertIsNone(ref())
+
+    def test_getinfo_prefetched(self):
+        s3 = S3FS("foo")
+        obj = minioObject("foo", "bar/baz.txt", size=3)
+        info = s3.getinfo("bar/baz.txt", namespaces=["details"], _prefetched=obj)
+        self.assertEqual(info.name, "baz.txt")
+        self.assertTrue(info.is_file)
+        self.assertEqual(info.size, 3)
+
+    def test_s3_namespace(self):
+        s3 = S3FS("foo")
+        modified = datetime(2020, 1, 2, tzinfo=timezone.utc)
+        obj = minioObject("foo", "bar.txt", last_modified=modified, size=3)
+        info = s3.getinfo("bar.txt", namespaces=["s3"], _prefetched=obj)
+        self.assertEqual(info.raw["s3"]["last_modified"], 1577923200)
+        self.assertEqual(info.raw["s3"]["size"], 3)
+        self.assertIsNone(info.raw["s3"]["etag"])
+
+    def test_dt_utc_epoch(self):
+        for dt in (
+            datetime(2020, 1, 2, tzinfo=timezone.utc),
+            datetime(2021, 6, 30, 23, 59, 59, 999999, tzinfo=timezone.utc),
+            datetime(2021, 6, 30, 12, tzinfo=timezone(timedelta(hours=-5))),
+        ):
+            self.assertEqual(_dt_utc_epoch(dt), datetime_to_epoch(dt))
+        self.assertIsNone(_dt_utc_epoch(None))
+
+    def test_stat_cache(self):
+        s3 = S3FS("foo")
+        obj = minioObject("foo", "bar/baz.txt", size=3)
+        s3._cache_stat("bar/baz.txt", obj)
+        s3._cache_stat("bar", None)
+        self.assertIs(s3._minio_stat_object("bar/baz.txt", "bar/baz.txt"), obj)
+        with self.assertRaises(errors.ResourceNotFound):
+            s3._minio_stat_object("bar", "bar/")
+        s3._invalidate("bar/baz.txt")
+        self.assertEqual(len(s3._stat_cache), 0)
+
+        # Listed objects don't answer lookups that need the s3 namespace.
+        s3._cache_stat("bar/baz.txt", obj, listed=True)
+        self.assertEqual(s3._lookup_object("bar/baz.txt"), (True, obj))
+        self.assertEqual(
+            s3._lookup_object("bar/baz.txt", listed=False), (False, None)
         )
-        self.assertDictEqual(
-            s3._get_upload_args("unknown.unknown"),
-            {"ACL": "acl", "CacheControl": "cc", "ContentType": "binary/octet-stream"},
+
+    def test_prewarm_unreachable(self):
+        # nothing listens on port 1, and the constructor mustn't wait on it
+        start = time.monotonic()
+        S3FS("foo", endpoint="localhost:1", access_key="a", secret_key="b")
+        self.assertLess(time.monotonic() - start, S3FS._prewarm_timeout + 1)
+
+    def test_prewarm_url(self):
+        # The same (virtual host style) URL as the client's requests.
+        urls = []
+
+        class RecordingPool(urllib3.PoolManager):
+            def request(self, method, url, **kwargs):
+                urls.append(url)
+                raise urllib3.exceptions.HTTPError(url)
+
+        S3FS(
+            "foo", endpoint="s3.amazonaws.com", secure=True,
+            region="us-west-2", access_key="a", secret_key="b",
+            http_client=RecordingPool(),
         )
+        self.assertEqual(set(urls), {"https://foo.s3.us-west-2.amazonaws.com/"})
+
+    def test_s3file_spooled(self):
+        s3file = S3File.factory("foo", Mode("w+b"), None, spool_size=1024)
+        s3file.write(b"abc")
+        # truncate zero fills an in-memory buffer, as it would a file
+        self.assertEqual(s3file.truncate(6), 6)
+        self.assertEqual(s3file.length, 6)
+        s3file.seek(0)
+        buffer = bytearray(8)
+        self.assertEqual(s3file.readinto(buffer), 6)
+        self.assertEqual(bytes(buffer), b"abc\0\0\0\0\0")
+
+    def test_upload_args(self):
+        s3 = S3FS("foo")
+        for key, content_type in [
+            ("test.jpg", "image/jpeg"),
+            ("test.JPG", "image/jpeg"),
+            ("test.mp3", "audio/mpeg"),
+            ("test.json", "application/json"),
+            ("test.tar.gz", "application/x-tar"),
+            ("unknown.unknown", "binary/octet-stream"),
+            ("unknown", "binary/octet-stream"),
+        ]:
+            self.assertDictEqual(
+                s3._get_upload_args(key),
+                {"content_type": content_type, "metadata": None},
+            )